@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
 # create_bitmap_animation.py — Sprite sheet generator with diagonal rainbow + 3D warp
 # Guarantees: when --bpp 8, palette index 0 (dark gray) is used ONLY for background.
+# Optional: the per-frame perspective warp uses opencv-python if installed; --numba
+#   opts into the Numba kernel in warp_numba.py instead.
 #
 # Example:
 #   python create_bitmap_animation.py --text "@cmprmsd" --font /path/DejaVuSans-Bold.ttf \
 #       --out sheet.bmp --cols 8 --rows 4 --frames 32 --size 160x160 --bpp 8 --scroll-cycles 1
 
-import argparse, math, colorsys
+import argparse, math, colorsys, struct, multiprocessing
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
+try:
+    import cv2  # optional: SIMD perspective warp, Pillow is used otherwise
+except ImportError:
+    cv2 = None
+
 # Background / transparency key color (dark gray, avoids any overlap with magenta)
 KEY_BG = (32, 32, 32)
+# Transparent KEY_BG as one packed RGBA pixel, for uint32 views of RGBA arrays
+_KEY_BG_PIXEL = np.array((*KEY_BG, 0), dtype=np.uint8).view(np.uint32)[0]
 
 def parse_size(s):
     w, h = s.lower().split("x")
@@ -19,14 +28,15 @@ def parse_size(s):
 
 def best_fit_text_rgba(text, font_path, max_w, max_h, pad=2):
     lo, hi, best = 8, 512, None
+    fonts = {}  # size -> loaded face, so the final render reuses it
+    # One tiny draw context for measuring; textbbox handles multiline text
+    measure = ImageDraw.Draw(Image.new("L", (1, 1)))
     # Find largest size that fits
     while lo <= hi:
         mid = (lo + hi) // 2
-        font = ImageFont.truetype(font_path, size=mid)
-        # Get exact bbox of drawn text at (0,0)
-        temp_img = Image.new("L", (max_w, max_h), 0)
-        draw = ImageDraw.Draw(temp_img)
-        bbox = draw.textbbox((0, 0), text, font=font)
+        font = fonts[mid] = ImageFont.truetype(font_path, size=mid)
+        # Exact bbox of drawn text at (0,0)
+        bbox = measure.textbbox((0, 0), text, font=font)
         w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
         if w + 2*pad <= max_w and h + 2*pad <= max_h:
             best = (mid, bbox)
@@ -38,7 +48,7 @@ def best_fit_text_rgba(text, font_path, max_w, max_h, pad=2):
         best = (12, (0, 0, 12, 12))
 
     size, bbox = best
-    font = ImageFont.truetype(font_path, size=size)
+    font = fonts.get(size) or ImageFont.truetype(font_path, size=size)
     w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
 
     # Render exactly to bbox size + pad
@@ -59,148 +69,237 @@ def best_fit_text_rgba(text, font_path, max_w, max_h, pad=2):
 
 
 def find_perspective_coeffs(dst_quad, src_quad):
-    A, B = [], []
-    for (xd, yd), (xs, ys) in zip(dst_quad, src_quad):
-        A.append([xd, yd, 1, 0, 0, 0, -xs*xd, -xs*yd])
-        A.append([0, 0, 0, xd, yd, 1, -ys*xd, -ys*yd])
-        B.append(xs); B.append(ys)
-    A = np.array(A, dtype=float)
-    B = np.array(B, dtype=float)
-    return np.linalg.lstsq(A, B, rcond=None)[0].tolist()
+    # 4 point pairs -> exactly determined 8x8 system; a plain LU solve suffices
+    A = np.zeros((8, 8))
+    B = np.empty(8)
+    for i, ((xd, yd), (xs, ys)) in enumerate(zip(dst_quad, src_quad)):
+        A[2*i, 0:3] = xd, yd, 1
+        A[2*i, 6:8] = -xs*xd, -xs*yd
+        A[2*i+1, 3:6] = xd, yd, 1
+        A[2*i+1, 6:8] = -ys*xd, -ys*yd
+        B[2*i], B[2*i+1] = xs, ys
+    return np.linalg.solve(A, B).tolist()
+
+def warp_perspective(src_rgba, coeffs, size, dst=None, use_numba=False):
+    """Warp an RGBA image with Pillow-style PERSPECTIVE coeffs (output -> input
+    mapping) into an (H, W, 4) uint8 array, written to dst if given.
+    Uses the Numba kernel if asked to, else OpenCV, else Pillow's transform."""
+    W, H = size
+    if use_numba or cv2 is None:
+        if dst is None:
+            dst = np.empty((H, W, 4), dtype=np.uint8)
+        if use_numba:
+            from warp_numba import warp_perspective_numba
+            warp_perspective_numba(np.asarray(src_rgba), dst, np.asarray(coeffs, dtype=np.float64),
+                                   np.array((*KEY_BG, 0), dtype=np.uint8))
+        else:
+            dst[...] = np.asarray(src_rgba.transform((W, H), Image.PERSPECTIVE, coeffs, resample=Image.BILINEAR,
+                                                     fillcolor=(*KEY_BG, 0)))
+        return dst
+    # Pillow samples at pixel centers, OpenCV at pixel corners: shift by half a pixel
+    M = np.append(coeffs, 1.0).reshape(3, 3)
+    M = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]]) @ M @ np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+    src = np.asarray(src_rgba)
+    # Like Pillow, clamp samples near the source edge instead of blending in the
+    # border color (glyphs touch the tightly cropped edge). A 1px replicated pad
+    # covers every bilinear neighbour; BORDER_REPLICATE itself is far slower ...
+    padded = cv2.copyMakeBorder(src, 1, 1, 1, 1, cv2.BORDER_REPLICATE)
+    dst = cv2.warpPerspective(padded, np.array([[1, 0, 1], [0, 1, 1], [0, 0, 1]]) @ M, (W, H), dst=dst,
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=(*KEY_BG, 0))
+    # ... and fill only pixels whose center maps outside the source. Nearest
+    # sampling rounds, so it is "inside" exactly on Pillow's [0, w) x [0, h).
+    inside = cv2.warpPerspective(np.full(src.shape[:2], 255, np.uint8), M, (W, H),
+                                 flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+                                 borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    px = dst.view(np.uint32)[..., 0]  # whole RGBA pixels, one contiguous plane
+    np.copyto(px, _KEY_BG_PIXEL, where=(inside == 0))
+    return dst
 
 def rotate_xy(points, ax, ay):
+    """Rotate (n, 3) points about X by ax, then about Y by ay."""
     cx, sx = math.cos(ax), math.sin(ax)
     cy, sy = math.cos(ay), math.sin(ay)
-    out = []
-    for x, y, z in points:
-        y1 = y*cx - z*sx
-        z1 = y*sx + z*cx
-        x2 = x*cy + z1*sy
-        z2 = -x*sy + z1*cy
-        out.append((x2, y1, z2))
-    return out
+    R = np.array([[ cy, sx*sy, cx*sy],
+                  [  0,    cx,   -sx],
+                  [-sy, sx*cy, cx*cy]])
+    return points @ R.T
 
 def project(points, cx, cy, f):
-    out = []
-    for x, y, z in points:
-        d = f + z
-        if d < 1e-3: d = 1e-3
-        s = f / d
-        out.append((cx + x*s, cy + y*s))
-    return out
+    """Perspective-project (n, 3) points to (n, 2) screen coordinates."""
+    d = np.maximum(points[:, 2] + f, 1e-3)
+    s = f / d
+    return np.stack([cx + points[:, 0]*s, cy + points[:, 1]*s], axis=1)
 
 # === Diagonal rainbow source (never outputs exact magenta) ===
-def diagonal_rainbow_rgba(size, phase=0.0, avoid_transparent=True):
-    """
-    45° HSV rainbow (S=V=1).
-    If avoid_transparent, nudge exact magenta off 255,0,255.
-    (Not strictly needed when the background key is dark gray, but harmless.)
-    """
+def build_rainbow_lut(avoid_transparent=True):
+    """Return a (256, 4) uint8 RGBA table: row i = HSV(i/255, 1, 1), opaque.
+    If avoid_transparent, nudge exact magenta off 255,0,255."""
+    lut = np.empty((256, 4), dtype=np.uint8)
+    for i in range(256):
+        lut[i, :3] = [int(255*v) for v in colorsys.hsv_to_rgb(i / 255.0, 1.0, 1.0)]
+    lut[:, 3] = 255
+    if avoid_transparent:
+        m = (lut[:,0]==255) & (lut[:,1]==0) & (lut[:,2]==255)
+        lut[m, 2] = 254
+    return lut
+
+# Only 256 hues can occur (H is quantized to uint8), so convert them once;
+# the magenta guard is baked in here and never runs per frame.
+RAINBOW_LUT = build_rainbow_lut(avoid_transparent=True)
+RAINBOW_LUT_RAW = build_rainbow_lut(avoid_transparent=False)
+
+def diagonal_grid(size):
+    """(h, w) float32 position 0..1 along the x+y diagonal; frame invariant."""
     w, h = size
     x = np.arange(w)[None, :]          # shape (1, w)
     y = np.arange(h)[:, None]          # shape (h, 1)
-    u = (x + y) / max(1, (w - 1) + (h - 1))  # shape (h, w), 0..1 along x+y diagonal
-    H = (u + phase) % 1.0
-
-    H8 = np.uint8(H * 255)
-    S8 = np.full_like(H8, 255, dtype=np.uint8)
-    V8 = np.full_like(H8, 255, dtype=np.uint8)
-
-    hsv = np.dstack((H8, S8, V8))      # shape (h, w, 3)
-    rgb = Image.fromarray(hsv, mode="HSV").convert("RGBA")
-
-    if avoid_transparent:
-        arr = np.array(rgb, dtype=np.uint8)
-        # (255,0,255,*) -> (255,0,254,*)
-        m = (arr[...,0]==255) & (arr[...,1]==0) & (arr[...,2]==255)
-        arr[m, 2] = 254
-        rgb = Image.fromarray(arr, "RGBA")
-    return rgb
+    return ((x + y) / max(1, (w - 1) + (h - 1))).astype(np.float32)
 
+def diagonal_rainbow_rgba(u, phase=0.0, lut=RAINBOW_LUT, alpha=None):
+    """
+    45° HSV rainbow (S=V=1) over the diagonal grid u, shifted by phase,
+    looked up from a rainbow LUT (see build_rainbow_lut).
+    If given, the (h, w) alpha array is written into the alpha channel.
+    """
+    h, w = u.shape
+    H8 = ((u + phase) % 1.0 * 255).astype(np.uint8)
+    arr = np.take(lut, H8, axis=0)     # shape (h, w, 4)
+    if alpha is not None:
+        arr[..., 3] = alpha
+    return Image.frombuffer("RGBA", (w, h), arr, "raw", "RGBA", 0, 1)
+
+
+def _render_frame(ctx, i, dst=None):
+    """Warp frame i of the loop described by ctx into an (H, W, 4) array,
+    RGB already keyed to KEY_BG where alpha is below the threshold."""
+    t = i / ctx["n_frames"]
+    ax = ctx["ax_amp"] * math.sin(2*math.pi*t)
+    ay = ctx["ay_amp"] * math.cos(2*math.pi*t)
+    quad = project(rotate_xy(ctx["obj"], ax, ay), ctx["cx"], ctx["cy"], ctx["focal"])
+    coeffs = find_perspective_coeffs(quad, ctx["src_rect"])
+
+    # Rainbow in source space; optional scroll
+    rainbow = ctx["static_rainbow"]
+    if rainbow is None:
+        phase = (t * ctx["scroll_cycles"]) % 1.0
+        rainbow = diagonal_rainbow_rgba(ctx["u"], phase=phase, lut=ctx["lut"], alpha=ctx["glyph_alpha"])
+
+    frame = warp_perspective(rainbow, coeffs, ctx["frame_size"], dst=dst, use_numba=ctx["use_numba"])
+    # Chroma key while the frame is hot in cache: below-threshold alpha -> background
+    np.copyto(frame.view(np.uint32)[..., 0], _KEY_BG_PIXEL,
+              where=(frame[..., 3] < ctx["alpha_thresh"]))
+    return frame
+
+# Per-process frame context, installed once by the Pool initializer
+_worker_ctx = None
+
+def _init_worker(ctx):
+    global _worker_ctx
+    _worker_ctx = ctx
+
+def _render_frame_worker(i):
+    return _render_frame(_worker_ctx, i)
 
 def generate_frames(text_rgba, frame_size, n_frames, ax_deg, ay_deg, focal,
-                    alpha_thresh, scroll_cycles, avoid_transparent):
+                    alpha_thresh, scroll_cycles, avoid_transparent, jobs=1, use_numba=False):
+    """Return all frames as one (n_frames, H, W, 3) uint8 array over KEY_BG.
+    With jobs > 1 the frames are rendered by a pool of worker processes;
+    use_numba selects the Numba warp kernel (see warp_perspective)."""
     W, H = frame_size
     src_w, src_h = text_rgba.size
-    src_rect = [(0,0),(src_w,0),(src_w,src_h),(0,src_h)]
-    obj = [(-src_w/2, -src_h/2, 0), (src_w/2, -src_h/2, 0),
-           (src_w/2,  src_h/2, 0), (-src_w/2,  src_h/2, 0)]
-    cx, cy = W/2, H/2
-    ax_amp, ay_amp = math.radians(ax_deg), math.radians(ay_deg)
-
-    glyph_alpha = text_rgba.split()[3]
-
-    frames = []
-    for i in range(n_frames):
-        t = i / n_frames
-        ax = ax_amp * math.sin(2*math.pi*t)
-        ay = ay_amp * math.cos(2*math.pi*t)
-        quad = project(rotate_xy(obj, ax, ay), cx, cy, focal)
-        coeffs = find_perspective_coeffs(quad, src_rect)
-
-        # Rainbow in source space; optional scroll
-        phase = (t * scroll_cycles) % 1.0 if scroll_cycles != 0 else 0.0
-        rainbow = diagonal_rainbow_rgba(text_rgba.size, phase=phase, avoid_transparent=avoid_transparent)
-        rainbow.putalpha(glyph_alpha)
-
-        warped = rainbow.transform((W, H), Image.PERSPECTIVE, coeffs, resample=Image.BILINEAR)
-        alpha = warped.split()[3]
-        mask = alpha.point(lambda a: 255 if a >= alpha_thresh else 0, 'L')
-
-        frame = Image.new("RGB", (W, H), KEY_BG)
-        frame.paste(warped.convert("RGB"), (0,0), mask)
-        frames.append(frame)
-    return frames
+    # One RGBA copy via __array_interface__; the alpha slice is a view of it
+    glyph_alpha = np.asarray(text_rgba)[..., 3]
+    u = diagonal_grid(text_rgba.size)
+    lut = RAINBOW_LUT if avoid_transparent else RAINBOW_LUT_RAW
+
+    # Without scrolling every frame shares the same source; build it once
+    static_rainbow = None
+    if scroll_cycles == 0:
+        static_rainbow = diagonal_rainbow_rgba(u, phase=0.0, lut=lut, alpha=glyph_alpha)
+
+    # Everything frames have in common; shipped to each worker only once
+    ctx = {
+        "frame_size": frame_size,
+        "n_frames": n_frames,
+        "src_rect": [(0,0),(src_w,0),(src_w,src_h),(0,src_h)],
+        "obj": np.array([(-src_w/2, -src_h/2, 0), (src_w/2, -src_h/2, 0),
+                         (src_w/2,  src_h/2, 0), (-src_w/2,  src_h/2, 0)], dtype=np.float64),
+        "cx": W/2, "cy": H/2, "focal": focal,
+        "ax_amp": math.radians(ax_deg), "ay_amp": math.radians(ay_deg),
+        "scroll_cycles": scroll_cycles, "alpha_thresh": alpha_thresh,
+        "glyph_alpha": glyph_alpha, "u": u, "lut": lut,
+        "static_rainbow": static_rainbow,
+        "use_numba": use_numba,
+    }
+
+    # Every frame lands in its slot of one batch array
+    frames = np.empty((n_frames, H, W, 4), dtype=np.uint8)
+    if jobs > 1 and n_frames > 1:
+        with multiprocessing.Pool(min(jobs, n_frames), initializer=_init_worker, initargs=(ctx,)) as pool:
+            for i, fr in enumerate(pool.imap(_render_frame_worker, range(n_frames))):
+                frames[i] = fr
+    else:
+        for i in range(n_frames):
+            # No-op copy when the warp wrote in place, correct if it allocated
+            frames[i] = _render_frame(ctx, i, dst=frames[i])
+
+    return frames[..., :3]
 
 def pack_sheet(frames, cols, rows):
-    assert len(frames) <= cols*rows
-    fw, fh = frames[0].size
-    sheet = Image.new("RGB", (cols*fw, rows*fh), KEY_BG)
-    for idx, im in enumerate(frames):
-        r = idx // cols
-        c = idx % cols
-        sheet.paste(im, (c*fw, r*fh))
-    return sheet
+    """Lay out (N, H, W, 3) frames row-major on a cols x rows grid; unused
+    cells stay KEY_BG."""
+    n, fh, fw = frames.shape[:3]
+    assert n <= cols*rows
+    if n < cols*rows:
+        pad = np.empty((cols*rows - n, fh, fw, 3), dtype=np.uint8)
+        pad[...] = KEY_BG
+        frames = np.concatenate([frames, pad])
+    sheet = frames.reshape(rows, cols, fh, fw, 3).transpose(0, 2, 1, 3, 4).reshape(rows*fh, cols*fw, 3)
+    return Image.fromarray(sheet)
 
 # === Palette helpers for compact 8-bit output (index 0 = KEY_BG only) ===
 def build_rainbow_palette():
-    """Return a 256*3 list for Image.putpalette().
+    """Return a 256*3 RGB palette list.
     Index 0 = KEY_BG (transparent), 1..255 = rainbow hues.
     Avoid exact (255,0,255) inside the rainbow range."""
     pal = [KEY_BG[0], KEY_BG[1], KEY_BG[2]]  # index 0 reserved for background
-    for i in range(1, 256):
-        h = i / 255.0
-        r, g, b = [int(255*v) for v in colorsys.hsv_to_rgb(h, 1.0, 1.0)]
-        # Avoid exact magenta in non-zero indices (purely for safety with magenta-sensitive tools)
-        if (r, g, b) == (255, 0, 255):
-            b = 254
-        pal.extend([r, g, b])
+    # Same hues as the frames, magenta guard already applied in RAINBOW_LUT
+    pal.extend(RAINBOW_LUT[1:, :3].ravel().tolist())
     return pal  # length 768
 
-def quantize_to_fixed_palette(img_rgb, palette_rgb_list):
-    """Quantize to a fixed palette (no dithering) and return P-mode image."""
+def quantize_and_fix(img_rgb, palette_rgb_list):
+    """Quantize to a fixed palette (Pillow, no dithering) and return the
+    (h, w) uint8 index array. Only true background (exact KEY_BG) gets
+    index 0."""
     pal_img = Image.new("P", (1, 1))
     pal_img.putpalette(palette_rgb_list)
-    return img_rgb.quantize(palette=pal_img, dither=Image.Dither.NONE)
-
-def force_background_index0(p_img, orig_rgb, palette):
-    """Ensure only true background is index 0."""
-    # Identify background pixels in the original RGB (exact KEY_BG)
-    arr_rgb = np.array(orig_rgb)
-    bg = (arr_rgb[...,0]==KEY_BG[0]) & (arr_rgb[...,1]==KEY_BG[1]) & (arr_rgb[...,2]==KEY_BG[2])
-
-    arr_p = np.array(p_img)
-    # Set background to 0
-    arr_p[bg] = 0
-
-    # Safety: if any non-background got 0, push it to a nonzero palette index (use 1)
-    mask_err = (~bg) & (arr_p == 0)
-    if np.any(mask_err):
-        arr_p[mask_err] = 1
-
-    out = Image.fromarray(arr_p, "P")
-    out.putpalette(palette)
-    return out
+    idx = np.array(img_rgb.quantize(palette=pal_img, dither=Image.Dither.NONE))
+    # Contiguous band planes compare much faster than strided RGB channels
+    r, g, b = (np.asarray(band) for band in img_rgb.split())
+    bg = (r==KEY_BG[0]) & (g==KEY_BG[1]) & (b==KEY_BG[2])
+    # Safety: non-background that landed on 0 is pushed to a nonzero index (use 1)
+    np.copyto(idx, 1, where=(idx == 0) & ~bg)
+    np.copyto(idx, 0, where=bg)
+    return idx
+
+def write_bmp8(path, idx, palette_rgb_list):
+    """Write an (h, w) index array as an uncompressed 8-bit paletted BMP
+    (BITMAPINFOHEADER, 256-entry BGRX palette, bottom-up rows)."""
+    h, w = idx.shape
+    stride = (w + 3) & ~3
+    pal = np.zeros((256, 4), dtype=np.uint8)
+    rgb = np.array(palette_rgb_list, dtype=np.uint8).reshape(-1, 3)
+    pal[:len(rgb), :3] = rgb[:, ::-1]
+    rows = np.zeros((h, stride), dtype=np.uint8)
+    rows[:, :w] = idx[::-1]
+    offset = 14 + 40 + pal.nbytes
+    with open(path, "wb") as fh:
+        fh.write(struct.pack("<2sIHHI", b"BM", offset + rows.nbytes, 0, 0, offset))
+        fh.write(struct.pack("<IiiHHIIiiII", 40, w, h, 1, 8, 0, rows.nbytes,
+                             3780, 3780, 256, 256))  # 3780 px/m = 96 dpi
+        fh.write(pal.tobytes())
+        fh.write(rows.tobytes())
 
 def main():
     ap = argparse.ArgumentParser()
@@ -219,6 +318,10 @@ def main():
                     help="BMP bit depth: 24 (default) or 8 (paletted).")
     ap.add_argument("--scroll-cycles", type=float, default=0.0,
                     help="Rainbow scroll cycles per full loop (0 = static).")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Worker processes for frame rendering (0 = all CPUs).")
+    ap.add_argument("--numba", action="store_true",
+                    help="Warp with the Numba kernel (compiled once, cached on disk) instead of OpenCV/Pillow.")
     ap.add_argument(
         "--avoid-transparent",
         dest="avoid_transparent",
@@ -237,6 +340,13 @@ def main():
     W,H = parse_size(args.size)
     if args.frames > args.cols*args.rows:
         raise SystemExit("frames must be <= cols*rows")
+    if args.jobs < 0:
+        raise SystemExit("jobs must be >= 0")
+    if args.numba:
+        try:
+            import warp_numba  # fail early, before any rendering
+        except ImportError as e:
+            raise SystemExit(f"--numba needs numba installed ({e})")
 
     text_rgba = best_fit_text_rgba(args.text, args.font, int(W*0.9), int(H*0.55), pad=4)
     frames = generate_frames(
@@ -244,18 +354,18 @@ def main():
         args.ax, args.ay, args.focal,
         max(0, min(255, args.alpha_thresh)),
         args.scroll_cycles,
-        args.avoid_transparent
+        args.avoid_transparent,
+        jobs=args.jobs or multiprocessing.cpu_count(),
+        use_numba=args.numba
     )
 
     sheet = pack_sheet(frames, args.cols, args.rows)
 
     if args.bpp == 8:
         palette = build_rainbow_palette()
-        # Quantize using fixed palette
-        sheet_p = quantize_to_fixed_palette(sheet, palette)
-        # Force only true background to index 0; never glyphs
-        sheet_p = force_background_index0(sheet_p, sheet, palette)
-        sheet_p.save(args.out, format="BMP")  # 8-bit paletted BMP
+        # Quantize using fixed palette; only true background gets index 0, never glyphs
+        idx = quantize_and_fix(sheet, palette)
+        write_bmp8(args.out, idx, palette)  # 8-bit paletted BMP
     else:
         # Windows BMP with 24-bit pixels (BI_RGB, uncompressed).
         sheet.save(args.out, format="BMP", bits=24)
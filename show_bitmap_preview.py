@@ -9,7 +9,8 @@
 # - Keys: space = pause/resume, left/right = step, q/esc = quit
 
 import argparse, time
-from PIL import Image, ImageTk
+import numpy as np
+from PIL import Image
 import tkinter as tk
 
 MAGENTA = (255, 0, 255)
@@ -26,14 +27,11 @@ def parse_args():
     return ap.parse_args()
 
 def make_checker(w, h, cell=10):
-    from PIL import ImageDraw
-    img = Image.new("RGB", (w, h), (200, 200, 200))
-    drw = ImageDraw.Draw(img)
-    for y in range(0, h, cell):
-        for x in range(0, w, cell):
-            if ((x // cell) + (y // cell)) % 2 == 0:
-                drw.rectangle([x, y, x + cell - 1, y + cell - 1], fill=(240, 240, 240))
-    return img
+    base = np.array([[1, 0], [0, 1]], np.uint8)
+    tiles = np.kron(base, np.ones((cell, cell), np.uint8))
+    tiles = np.tile(tiles, (h // tiles.shape[0] + 1, w // tiles.shape[1] + 1))[:h, :w]
+    arr = np.where(tiles[..., None], np.array([240, 240, 240], np.uint8), np.array([200, 200, 200], np.uint8))
+    return Image.fromarray(arr, "RGB")
 
 def solid_bg(w, h, spec):
     if spec == "magenta":
@@ -62,17 +60,11 @@ def extract_frames(sheet, cols, rows, n_frames=None):
         frames.append(crop)
     return frames
 
-def chroma_over_bg(frame_rgb, bg_rgb):
-    """Treat MAGENTA as transparent and composite over background."""
-    fr = frame_rgb.convert("RGBA")
-    r, g, b, a = fr.split()
-    # Create mask where magenta becomes transparent
-    import numpy as np
-    arr = np.array(fr)
-    mask_opaque = ~((arr[...,0]==255) & (arr[...,1]==0) & (arr[...,2]==255))
-    arr[...,3] = (mask_opaque * 255).astype("uint8")
-    fr = Image.fromarray(arr, "RGBA")
-    return Image.alpha_composite(bg_rgb.convert("RGBA"), fr).convert("RGB")
+def chroma_over_bg(frame_rgb, bg_arr):
+    """Treat MAGENTA as transparent and show the (h, w, 3) background there."""
+    arr = np.asarray(frame_rgb)
+    mask = (arr[...,0]==255) & (arr[...,1]==0) & (arr[...,2]==255)
+    return Image.fromarray(np.where(mask[..., None], bg_arr, arr), "RGB")
 
 def main():
     args = parse_args()
@@ -90,9 +82,10 @@ def main():
         bg = solid_bg(fw, fh, args.bg)
 
     # Pre-composite chroma and scale upfront for smooth playback
+    bg_arr = np.asarray(bg.convert("RGB"))
     prepared = []
     for fr in frames:
-        comp = chroma_over_bg(fr, bg)
+        comp = chroma_over_bg(fr, bg_arr)
         if scale != 1:
             comp = comp.resize((vw, vh), Image.NEAREST)
         prepared.append(comp)
@@ -102,24 +95,29 @@ def main():
     root.title(f"Preview — {args.sheet}")
     lbl = tk.Label(root)
     lbl.pack()
-    tk_img = None
+    # Hand every frame to Tk once as native PPM data; kept on root so they aren't GC'd
+    root.tk_frames = [
+        tk.PhotoImage(master=root, format="PPM",
+                      data=b"P6\n%d %d\n255\n" % im.size + im.tobytes())
+        for im in prepared
+    ]
 
-    state = {"i": 0, "paused": False, "last": time.time(), "spf": 1.0/max(1e-6, args.fps)}
+    state = {"i": 0, "paused": False, "next": time.time(), "spf": 1.0/max(1e-6, args.fps)}
 
     def render():
-        nonlocal tk_img
-        img = prepared[state["i"]]
-        tk_img = ImageTk.PhotoImage(img)
-        lbl.configure(image=tk_img)
+        lbl.configure(image=root.tk_frames[state["i"]])
 
     def tick():
         if not state["paused"]:
-            now = time.time()
-            if now - state["last"] >= state["spf"]:
-                state["i"] = (state["i"] + 1) % len(prepared)
-                state["last"] = now
-                render()
-        root.after(5, tick)
+            state["i"] = (state["i"] + 1) % len(prepared)
+            render()
+        # Wake once per frame, aimed at the next deadline so delays don't drift;
+        # after a long stall (e.g. window drag) resync instead of catching up
+        now = time.time()
+        state["next"] += state["spf"]
+        if now - state["next"] > state["spf"]:
+            state["next"] = now
+        root.after(max(0, int((state["next"] - now) * 1000)), tick)
 
     def on_key(ev):
         k = ev.keysym.lower()
@@ -134,7 +132,8 @@ def main():
 
     root.bind("<Key>", on_key)
     render()
-    root.after(5, tick)
+    state["next"] += state["spf"]
+    root.after(int(state["spf"] * 1000), tick)
     root.mainloop()
 
 if __name__ == "__main__":
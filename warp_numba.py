@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# warp_numba.py — optional Numba perspective warp for create_bitmap_animation.py (--numba)
+# Lives in its own module so numba's on-disk cache is keyed to a stable module
+# name: the kernel compiles once, not on every run or in every --jobs worker.
+
+import math
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True, fastmath=True, cache=True)
+def warp_perspective_numba(src, dst, coeffs, border):
+    """Inverse-map every dst pixel through coeffs and bilinearly sample src
+    (Pillow conventions: pixel centers, edge-clamped neighbours)."""
+    a, b, c, d, e, f, g, h = coeffs
+    sh, sw = src.shape[0], src.shape[1]
+    for y in prange(dst.shape[0]):
+        yc = y + 0.5
+        for x in range(dst.shape[1]):
+            xc = x + 0.5
+            w = g*xc + h*yc + 1.0
+            xi = (a*xc + b*yc + c) / w
+            yi = (d*xc + e*yc + f) / w
+            if not (0.0 <= xi < sw and 0.0 <= yi < sh):
+                for k in range(4):
+                    dst[y, x, k] = border[k]
+                continue
+            xs, ys = xi - 0.5, yi - 0.5
+            x0, y0 = int(math.floor(xs)), int(math.floor(ys))
+            fx, fy = xs - x0, ys - y0
+            x1, y1 = min(x0 + 1, sw - 1), min(y0 + 1, sh - 1)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            for k in range(4):
+                top = src[y0, x0, k] * (1.0 - fx) + src[y0, x1, k] * fx
+                bot = src[y1, x0, k] * (1.0 - fx) + src[y1, x1, k] * fx
+                dst[y, x, k] = np.uint8(top * (1.0 - fy) + bot * fy + 0.5)